@@ -0,0 +1,24 @@
+# kernels.py의 지표 커널을 AOT 컴파일해 sma_kernels 확장 모듈을 생성
+# (GitHub Actions에서 스크립트 실행 전에 한 번 실행하고 결과물을 캐시함)
+import os
+
+from numba import njit
+from numba.pycc import CC
+
+from kernels import LAST_INDICATORS_SIG, KERNEL_OPTIONS, last_indicators_py
+
+# CC.export에는 fastmath 등 컴파일 옵션을 줄 수 없으므로, JIT 폴백과 같은 옵션(KERNEL_OPTIONS)으로
+# 만든 njit 커널을 export 함수에서 호출 -> 호출된 커널은 자신의 옵션으로 컴파일되어 두 경로의 결과가 같음
+last_indicators_kernel = njit(LAST_INDICATORS_SIG, **KERNEL_OPTIONS)(last_indicators_py)
+
+cc = CC('sma_kernels')
+cc.output_dir = os.path.dirname(os.path.abspath(__file__))
+# JIT과 같은 CPU 기능(FMA 등)을 쓰도록 host 대상 (워크플로 캐시 키에 CPU 기능 해시 포함)
+cc.target_cpu = 'host'
+
+@cc.export('last_indicators', LAST_INDICATORS_SIG)
+def last_indicators(close, com):
+    return last_indicators_kernel(close, com)
+
+if __name__ == "__main__":
+    cc.compile()
@@ -0,0 +1,15 @@
+# 지표 커널 소스 (numba import 없음)
+# sma_trade.py는 AOT 모듈(sma_kernels)이 없을 때만 이 함수를 njit으로 컴파일하고,
+# build_aot.py는 같은 함수/시그니처/옵션으로 sma_kernels를 AOT 컴파일함
+LAST_INDICATORS_SIG = 'UniTuple(f8, 3)(f8[:], f8)'
+# 입력은 NaN이 제거된 종가이므로 fastmath(FMA/재결합 허용) 사용 (AOT 빌드와 JIT 폴백 공통)
+KERNEL_OPTIONS = {'fastmath': True, 'boundscheck': False}
+
+# SMA5 / EMA20 / SMA180 마지막 값을 한 번에 계산
+# (EMA는 ewm(com, adjust=False)와 같은 점화식)
+def last_indicators_py(close, com):
+    alpha = 1.0 / (1.0 + com)
+    ema = close[0]
+    for i in range(1, close.shape[0]):
+        ema = alpha * close[i] + (1.0 - alpha) * ema
+    return close[-5:].sum() / 5.0, ema, close[-180:].sum() / 180.0
@@ -1,15 +1,24 @@
-import yfinance as yf
-import pandas as pd
 import os
-import smtplib
-import ssl
-from email.message import EmailMessage
-from datetime import datetime
+# numba 컴파일 캐시 위치 (GitHub Actions에서 actions/cache로 유지, JIT 폴백의 numba import 전에 지정)
+os.environ.setdefault('NUMBA_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.numba_cache'))
+import numpy as np
+import time
+from datetime import datetime, date, timedelta, timezone
+# requests / yfinance / smtplib / ssl / email은 무거운 import라 실제로 필요할 때만 함수 안에서 불러옴
 
 # --- 환경 변수 로드 (GitHub Secrets에서 가져옴) ---
 EMAIL_SENDER = os.getenv("EMAIL_ADDRESS")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
-EMAIL_RECEIVER = os.getenv("EMAIL_TO_1") # 수동 실행 시 빈 문자열("")이 됨
+# 쉼표로 구분된 여러 수신자 지원 (수동 실행 시 빈 문자열("") -> 빈 튜플)
+RECIPIENTS = tuple(r.strip() for r in (os.getenv("EMAIL_TO_1") or "").split(",") if r.strip())
+
+# --- 데이터 캐시 설정 (GitHub Actions에서는 actions/cache로 유지) ---
+CACHE_DIR = os.path.expanduser("~/.cache/sma_trade")
+CACHE_MAX_AGE = 2 * 24 * 60 * 60 # 2일이 지난 캐시 파일은 삭제
+
+# --- Yahoo chart API (pandas/yfinance 없이 종가만 직접 가져옴) ---
+CHART_URL = "https://query1.finance.yahoo.com/v8/finance/chart/{ticker}"
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Safari/537.36"
 
 # --- 기본 설정 ---
 Ticker = "QLD"
@@ -24,62 +33,219 @@ my_strategy = {
     "SMA180 > SMA5 > EMA20": 0.4,
     "SMA180 > EMA20 > SMA5": 0.1
 }
+# 상태 튜플 -> 비중 (모듈 로드 시 한 번만 변환)
+STRATEGY_MAP = {tuple(k.split(' > ')): v for k, v in my_strategy.items()}
+
+# --- 이메일 본문 템플릿 (모듈 로드 시 한 번만 생성) ---
+BODY_TEMPLATE = """
+{last_date} 기준 {ticker}의 현재 상태 및 권장 비중입니다. 나머지는 SGOV를 매수하십시오.
+
+■ 현재 SMA 상태
+-> {state}
+
+■ 권장 비중 (전략 기준)
+-> {alloc_pct:.0f}%
+""".strip()
 
 # --- 헬퍼 함수 1: SMA 상태 계산 ---
+SMA_NAMES = ('SMA5', 'EMA20', 'SMA180')
+# 크기 순서(내림차순)별 SMA_NAMES 인덱스 순열
+SMA_PERMS = ((0, 1, 2), (0, 2, 1), (2, 0, 1), (1, 0, 2), (1, 2, 0), (2, 1, 0))
+
 def get_sma_state(row):
-    if pd.isna(row['SMA5']) or pd.isna(row['EMA20']) or pd.isna(row['SMA180']):
+    a, b, c = row['SMA5'], row['EMA20'], row['SMA180']
+    if a != a or b != b or c != c: # NaN은 자기 자신과 같지 않음
         return None
-    smas = {
-        'SMA5': row['SMA5'],
-        'EMA20': row['EMA20'],
-        'SMA180': row['SMA180']
-    }
-    sorted_state = tuple(k for k, v in sorted(smas.items(), key=lambda item: item[1], reverse=True))
-    return sorted_state
-
-# --- 헬퍼 함수 2: 현재 상태만 가져오기 ---
-def get_current_recommendation(ticker, strategy_map_config):
+    if a >= b:
+        if b >= c: idx = 0   # a, b, c
+        elif a >= c: idx = 1 # a, c, b
+        else: idx = 2        # c, a, b
+    else:
+        if a >= c: idx = 3   # b, a, c
+        elif b >= c: idx = 4 # b, c, a
+        else: idx = 5        # c, b, a
+    return tuple(SMA_NAMES[i] for i in SMA_PERMS[idx])
+
+# --- 헬퍼 함수 2: 지표 커널 (소스는 kernels.py, build_aot.py로 AOT 컴파일) ---
+# AOT 모듈이 빌드되어 있으면 numba import와 JIT 컴파일 없이 그것을 사용
+# (numpy/numba 버전이 바뀌어 로드에 실패하는 경우도 JIT으로 대체)
+try:
+    from sma_kernels import last_indicators
+except Exception as e:
+    if not isinstance(e, ModuleNotFoundError):
+        print(f"[커널] AOT 모듈 로드 실패, JIT으로 대체: {e}")
+    from numba import njit
+    from kernels import LAST_INDICATORS_SIG, KERNEL_OPTIONS, last_indicators_py
+    last_indicators = njit(LAST_INDICATORS_SIG, cache=True, **KERNEL_OPTIONS)(last_indicators_py)
+
+# --- 헬퍼 함수 3: Yahoo 요청용 HTTP 세션 (연결 재사용 + 429/5xx 재시도) ---
+_SESSION = None
+
+def get_session():
+    global _SESSION
+    if _SESSION is None:
+        import requests
+        from requests.adapters import HTTPAdapter, Retry
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504],
+                      raise_on_status=False)
+        _SESSION = requests.Session()
+        _SESSION.mount('https://', HTTPAdapter(pool_maxsize=4, max_retries=retry))
+    return _SESSION
+
+# --- 헬퍼 함수 4: 종가 다운로드 (chart API 우선, 실패 시 yfinance) ---
+# 반환값: (날짜 문자열 배열 'YYYY-MM-DD', 수정 종가 float64 배열)
+def fetch_chart_closes(ticker, period):
+    resp = get_session().get(
+        CHART_URL.format(ticker=ticker),
+        params={"range": period, "interval": "1d", "includeAdjustedClose": "true"},
+        headers={"User-Agent": USER_AGENT},
+        timeout=10
+    )
+    resp.raise_for_status()
+    result = resp.json()["chart"]["result"][0]
+    # 거래소 현지 시각 기준 날짜 (auto_adjust=True와 같도록 adjclose 사용)
+    tz = timezone(timedelta(seconds=result["meta"]["gmtoffset"]))
+    adjclose = result["indicators"]["adjclose"][0]["adjclose"]
+    dates = np.array([datetime.fromtimestamp(ts, tz).strftime('%Y-%m-%d') for ts in result["timestamp"]],
+                     dtype='U10')
+    closes = np.array(adjclose, dtype=np.float64) # null -> NaN
+    return dates, closes
+
+def fetch_yfinance_closes(ticker, period):
+    import yfinance as yf
+    data = yf.Ticker(ticker, session=get_session()).history(period=period, auto_adjust=True)
+    dates = np.array([d.strftime('%Y-%m-%d') for d in data.index], dtype='U10')
+    closes = data['Close'].to_numpy(dtype=np.float64, copy=True)
+    return dates, closes
+
+def download_closes(ticker, period):
+    try:
+        dates, closes = fetch_chart_closes(ticker, period)
+    except Exception as e:
+        print(f"[{ticker}] chart API 실패, yfinance로 재시도: {e}")
+        try:
+            dates, closes = fetch_yfinance_closes(ticker, period)
+        except Exception as e:
+            print(f"[{ticker}] 다운로드 오류: {e}")
+            return np.array([], dtype='U10'), np.array([], dtype=np.float64)
+    # 종가가 비어 있는 날(NaN)은 한 번에 제거 -> 이후 지표 계산에서는 NaN 검사 불필요
+    valid = ~np.isnan(closes)
+    return dates[valid], closes[valid]
+
+# --- 헬퍼 함수 5: 다운로드 결과 캐시 (같은 날 재실행 시 네트워크 생략) ---
+def cached_download(ticker, period):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    now = time.time()
+    for name in os.listdir(CACHE_DIR):
+        old_path = os.path.join(CACHE_DIR, name)
+        # 이 스크립트가 쓰는 캐시 파일만 삭제 (.parquet은 이전 버전 캐시, .tmp는 중단된 쓰기)
+        if not name.endswith((".npz", ".parquet", ".tmp")) or not os.path.isfile(old_path):
+            continue
+        try:
+            if now - os.path.getmtime(old_path) > CACHE_MAX_AGE:
+                os.remove(old_path)
+        except OSError as e:
+            print(f"[캐시] 오래된 파일 삭제 실패 (무시): {e}")
+
+    path = os.path.join(CACHE_DIR, f"{ticker}_{date.today()}.npz")
+    if os.path.exists(path):
+        try:
+            with np.load(path) as cached:
+                dates, closes = cached['dates'], cached['closes']
+            print(f"[{ticker}] 캐시 사용: {path}")
+            return dates, closes
+        except Exception as e:
+            # 중단된 쓰기/불완전한 캐시 복원 등으로 깨진 파일은 지우고 다시 다운로드
+            print(f"[{ticker}] 캐시 파일 손상, 삭제 후 다시 다운로드: {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    dates, closes = download_closes(ticker, period)
+    if len(closes):
+        # 임시 파일에 다 쓴 뒤 교체해서, 중간에 중단돼도 깨진 캐시가 남지 않게 함
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, dates=dates, closes=closes)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[{ticker}] 캐시 저장 실패 (무시): {e}")
+    return dates, closes
+
+# --- 헬퍼 함수 6: 현재 상태만 가져오기 ---
+def get_current_recommendation(ticker, strategy_map=STRATEGY_MAP):
     print(f"[{ticker}] 최신 데이터 다운로드 중...")
     # SMA180 계산을 위해 1년치 데이터를 여유있게 가져옴
-    data = yf.download(ticker, period="1y", auto_adjust=True, progress=False)
-    
-    if data.empty:
+    dates, closes = cached_download(ticker, period="1y")
+
+    if len(closes) == 0:
         print("데이터 다운로드 실패")
         return "데이터 다운로드 실패", 0.0, datetime.now().strftime('%Y-%m-%d')
 
-    if isinstance(data.columns, pd.MultiIndex):
-        data.columns = data.columns.droplevel(1)
-
-    data['SMA5'] = data['Close'].rolling(5).mean()
-    data['EMA20'] = data['Close'].ewm(com=20, adjust=False).mean()
-    data['SMA180'] = data['Close'].rolling(180).mean()
+    last_date = str(dates[-1])
+    if len(closes) < 180:
+        print("SMA 계산 불가 (데이터 부족)")
+        return "SMA 계산 불가 (데이터 부족)", 0.0, last_date
 
-    last_valid_row = data.dropna().iloc[-1]
-    last_date = last_valid_row.name.strftime('%Y-%m-%d')
-    current_state = get_sma_state(last_valid_row)
+    # 마지막 날의 지표 값만 필요하므로 최근 200개 종가로 직접 계산
+    closes = closes[-200:]
+    sma5, ema20, sma180 = last_indicators(closes, 20.0)
+    current_state = get_sma_state({'SMA5': sma5, 'EMA20': ema20, 'SMA180': sma180})
 
     if current_state is None:
         print("SMA 계산 불가 (데이터 부족)")
         return "SMA 계산 불가 (데이터 부족)", 0.0, last_date
 
-    strategy_map = {}
-    for k_str, allocation in strategy_map_config.items():
-        key_tuple = tuple(k_str.split(' > '))
-        strategy_map[key_tuple] = allocation
-
     current_state_str = ' > '.join(current_state)
     current_alloc = strategy_map.get(current_state, 0.0) 
 
     return current_state_str, current_alloc, last_date
 
 
-# --- 헬퍼 함수 3: 이메일 전송 (수정됨) ---
-def send_email(subject, body, sender, password, receiver):
+# --- 헬퍼 클래스: SMTP 세션 (한 번 로그인 후 여러 메일 전송 가능) ---
+class SmtpSession:
+    def __init__(self, sender, password):
+        self.sender = sender
+        self.password = password
+        self.server = None
+
+    def __enter__(self):
+        import smtplib
+        import ssl
+        context = ssl.create_default_context()
+        self.server = smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context)
+        try:
+            self.server.login(self.sender, self.password)
+        except Exception:
+            self.server.close()
+            raise
+        return self
+
+    def send(self, msg):
+        self.server.send_message(msg)
+
+    def __exit__(self, exc_type, exc, tb):
+        import smtplib
+        try:
+            self.server.quit()
+        except smtplib.SMTPException:
+            self.server.close()
+
+
+# --- 헬퍼 함수 7: 수신자 미지정 안내 (send_email / print_minimal 공통) ---
+def print_no_receiver():
+    print("\n[이메일] 수신자(EMAIL_TO_1)가 지정되지 않았습니다 (수동 실행).")
+    print("콘솔 로그만 출력하고 이메일 발송은 건너뜁니다.")
+
+
+# --- 헬퍼 함수 8: 이메일 전송 (수정됨) ---
+def send_email(subject, body, sender, password, recipients):
     
-    # [수정 1] 수신자(receiver)가 비어있는지(None 또는 "") 먼저 확인
-    if not receiver: 
-        print("\n[이메일] 수신자(EMAIL_TO_1)가 지정되지 않았습니다 (수동 실행).")
-        print("콘솔 로그만 출력하고 이메일 발송은 건너뜁니다.")
+    # [수정 1] 수신자(recipients)가 비어있는지 먼저 확인
+    if not recipients:
+        print_no_receiver()
         return # 함수 종료
         
     # [수정 2] 수신자가 있을 경우에만 발신자 정보 확인
@@ -87,57 +253,66 @@ def send_email(subject, body, sender, password, receiver):
         print("\n[이메일] 발신자 정보(EMAIL_ADDRESS, EMAIL_PASSWORD)가 없습니다.")
         return # 함수 종료
 
-    print(f"\n[이메일 전송] {receiver}(으)로 알림 발송 시도...")
+    to = ", ".join(recipients)
+    print(f"\n[이메일 전송] {to}(으)로 알림 발송 시도...")
 
+    from email.message import EmailMessage
     msg = EmailMessage()
     msg["Subject"] = subject
     msg["From"] = sender
-    msg["To"] = receiver
+    msg["To"] = to
     msg.set_content(body) 
 
-    context = ssl.create_default_context()
     try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as server:
-            server.login(sender, password)
-            server.send_message(msg)
+        with SmtpSession(sender, password) as session:
+            session.send(msg)
         print("[이메일 전송] 성공!")
     except Exception as e:
         print(f"[이메일 전송] 실패: {e}")
 
 
-# --- 메인 로직 (변경 없음) ---
-if __name__ == "__main__":
-    
+# --- 헬퍼 함수 9: 수신자 없을 때 콘솔용 간단 출력 ---
+def print_minimal(ticker, state, alloc, last_date):
+    print("--- 분석 결과 (콘솔 로그) ---")
+    print(f"{last_date} {ticker}: {state} -> 권장 비중 {alloc * 100:.0f}%")
+    print("-" * 25)
+    print_no_receiver()
+
+
+# --- 메인 로직 ---
+def main():
     # 1. 현재 상태 및 비중 가져오기
-    current_state_str, current_alloc, last_date = get_current_recommendation(Ticker, my_strategy)
+    current_state_str, current_alloc, last_date = get_current_recommendation(Ticker)
+
+    # 수신자가 없으면(수동 실행) 이메일 본문을 만들지 않고 바로 종료
+    if not RECIPIENTS:
+        print_minimal(Ticker, current_state_str, current_alloc, last_date)
+        return
 
     # 2. 이메일 제목 및 본문 생성
     email_subject = f"주간 {Ticker} 리밸런싱 알림 ({last_date})"
     
-    email_body = f"""
-{last_date} 기준 {Ticker}의 현재 상태 및 권장 비중입니다. 나머지는 SGOV를 매수하십시오.
-
-■ 현재 SMA 상태
--> {current_state_str}
-
-■ 권장 비중 (전략 기준)
--> {current_alloc * 100:.0f}%
-
-"""
-    #for state_str, alloc in my_strategy.items():
-    #    email_body += f"- {state_str:<25}: {alloc * 100:.0f}%\n"
+    email_body = BODY_TEMPLATE.format(
+        last_date=last_date,
+        ticker=Ticker,
+        state=current_state_str,
+        alloc_pct=current_alloc * 100
+    )
 
     # (GitHub Actions 로그 확인을 위해 콘솔에는 항상 출력)
     print("--- 분석 결과 (콘솔 로그) ---")
-    print(email_body.strip())
+    print(email_body)
     print("-" * 25)
 
     # 3. 이메일 전송 실행
-    # (EMAIL_RECEIVER가 비어있으면 send_email 함수 내부에서 알아서 중단됨)
     send_email(
         subject=email_subject,
-        body=email_body.strip(),
+        body=email_body,
         sender=EMAIL_SENDER,
         password=EMAIL_PASSWORD,
-        receiver=EMAIL_RECEIVER
+        recipients=RECIPIENTS
     )
+
+
+if __name__ == "__main__":
+    main()